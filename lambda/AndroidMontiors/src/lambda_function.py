@@ -1,8 +1,11 @@
 import json
 import boto3
+from botocore.config import Config
 from datetime import datetime
-import uuid
+import math
 import os
+import threading
+import time
 import logging
 
 
@@ -10,19 +13,251 @@ logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
-dynamodb = boto3.resource('dynamodb')
+# Adaptive retry mode retries throttled writes with backoff and slows the
+# client down while DynamoDB keeps throttling. Attempts and socket timeouts
+# are kept small so a write's worst case fits in the function timeout
+MAX_WRITE_ATTEMPTS = int(os.environ.get('MAX_WRITE_ATTEMPTS', '3'))
+WRITE_TIMEOUT_SECONDS = float(os.environ.get('WRITE_TIMEOUT_SECONDS', '1'))
+dynamodb = boto3.resource('dynamodb', config=Config(
+    retries={'total_max_attempts': MAX_WRITE_ATTEMPTS, 'mode': 'adaptive'},
+    connect_timeout=WRITE_TIMEOUT_SECONDS,
+    read_timeout=WRITE_TIMEOUT_SECONDS
+))
+# Worst case for one write: every attempt hits both socket timeouts, plus
+# botocore's exponential backoff (1s, 2s, 4s, ... capped at 20s) between attempts
+WRITE_BUDGET_SECONDS = (MAX_WRITE_ATTEMPTS * 2 * WRITE_TIMEOUT_SECONDS +
+                        sum(min(2 ** attempt, 20) for attempt in range(MAX_WRITE_ATTEMPTS - 1)))
 table_name = os.environ.get('DYNAMODB_TABLE', 'AMS')  
 table = dynamodb.Table(table_name)
 
 
-iot_client = boto3.client('iot-data', region_name='us-east-1')  
+# Brightness control requests are handed to the debouncing control service
+lambda_client = boto3.client('lambda', region_name='us-east-1')
+BRIGHTNESS_CONTROL_FUNCTION = os.environ.get('BRIGHTNESS_CONTROL_FUNCTION', 'BbrightnessControl')
+
+# Table write capacity (WCU) shared by all concurrent ingest containers.
+# INGEST_CONCURRENCY must match the function's ReservedConcurrentExecutions,
+# otherwise scale-out multiplies the per-container share
+TABLE_WRITE_CAPACITY = float(os.environ.get('TABLE_WRITE_CAPACITY', '25'))
+INGEST_CONCURRENCY = max(1, int(os.environ.get('INGEST_CONCURRENCY', '1')))
+if TABLE_WRITE_CAPACITY <= 0:
+    raise ValueError(f"TABLE_WRITE_CAPACITY must be positive, got {TABLE_WRITE_CAPACITY}")
+# Unchanged metric state is written at most once per window per device
+COALESCE_WINDOW_SECONDS = float(os.environ.get('COALESCE_WINDOW_SECONDS', '10'))
+ERROR_FLUSH_SECONDS = float(os.environ.get('ERROR_FLUSH_SECONDS', '60'))
+
+# Deadline of the current invocation, so writes stop before Lambda times out
+invocation = threading.local()
+
+
+class WriteBudgetExceeded(Exception):
+    """Raised when a write could not finish before the invocation deadline"""
+
+
+def time_left():
+    deadline = getattr(invocation, 'deadline', None)
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class WriteTokenBucket:
+    """
+    Token bucket sized to this container's share of the table write capacity
+    Blocks the caller until a write token is available
+    """
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError(f"Write rate must be positive, got {rate}")
+        self.rate = rate
+        # At least one token must fit, or acquire() could never succeed
+        self.capacity = max(1, burst or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1, budget=None):
+        # Writes larger than the bucket wait for a full bucket and leave it in
+        # debt, so later writes pay for the extra units
+        needed = min(tokens, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= needed:
+                    self.tokens -= tokens
+                    return
+                wait = (needed - self.tokens) / self.rate
+            if budget is not None and wait > budget:
+                raise WriteBudgetExceeded(f"Write tokens not available within {budget:.1f}s")
+            budget = None if budget is None else budget - wait
+            time.sleep(wait)
+
+
+write_bucket = WriteTokenBucket(TABLE_WRITE_CAPACITY / INGEST_CONCURRENCY)
+
+# Latest metric state written per (device, metric), kept across warm invocations
+last_metric_state = {}
+metric_state_lock = threading.Lock()
+
+# Repeat error counts per (minute, error type) waiting to be added to the
+# ERROR record that the first occurrence already wrote
+pending_errors = {}
+written_error_keys = set()
+errors_lock = threading.Lock()
+last_error_flush = time.monotonic()
+
+
+def estimate_write_units(item):
+    """Approximate WCU for a put: one unit per started KB of attribute names and values"""
+    size = sum(len(str(name).encode('utf-8')) + len(str(value).encode('utf-8'))
+               for name, value in item.items())
+    return max(1, math.ceil(size / 1024))
+
+
+def put_item(item):
+    """
+    Write an item once the token bucket allows its estimated write units
+    Fails fast when the write might not finish while still leaving time
+    for the error record, so the event ends in the aggregated error path
+    """
+    remaining = time_left()
+    budget = None
+    if remaining is not None:
+        budget = remaining - 2 * WRITE_BUDGET_SECONDS
+        if budget < 0:
+            raise WriteBudgetExceeded(f"{remaining:.1f}s left, each write needs up to {WRITE_BUDGET_SECONDS:.1f}s")
+    write_bucket.acquire(estimate_write_units(item), budget)
+    table.put_item(Item=item)
+
+
+def put_metric_item(item, metric, fields):
+    """
+    Write a metric item unless it repeats the device's latest written state
+    within the coalescing window. Returns True if the item was written
+    """
+    key = (item['PK'], metric)
+    state = tuple(item.get(field) for field in fields)
+    event_time = datetime.fromisoformat(item['timestamp'])
+    with metric_state_lock:
+        previous = last_metric_state.get(key)
+        if previous is not None:
+            previous_time, previous_state = previous
+            if (previous_state == state and
+                    abs((event_time - previous_time).total_seconds()) < COALESCE_WINDOW_SECONDS):
+                logger.info(f"{metric} state unchanged for {item['PK']}, write coalesced")
+                return False
+    put_item(item)
+    with metric_state_lock:
+        previous = last_metric_state.get(key)
+        if previous is None or event_time >= previous[0]:
+            last_metric_state[key] = (event_time, state)
+    return True
+
+
+def write_error_record(minute, error_type, count, message, sample_event):
+    """Add an error count to the ERROR record for (minute, error type)"""
+    item = {
+        'PK': 'ERROR#AndroidMontiors',
+        'SK': f"ERROR#{minute}#{error_type}",
+        'error_message': message,
+        'updated_at': datetime.now().isoformat(),
+        'event_data': sample_event
+    }
+    remaining = time_left()
+    budget = None
+    if remaining is not None:
+        budget = remaining - WRITE_BUDGET_SECONDS
+        if budget < 0:
+            raise WriteBudgetExceeded(f"{remaining:.1f}s left, not enough to write the error record")
+    write_bucket.acquire(estimate_write_units(item), budget)
+    table.update_item(
+        Key={'PK': item['PK'], 'SK': item['SK']},
+        UpdateExpression=(
+            'ADD error_count :count '
+            'SET error_message = :message, updated_at = :now, '
+            'event_data = if_not_exists(event_data, :sample)'
+        ),
+        ExpressionAttributeValues={
+            ':count': count,
+            ':message': message,
+            ':now': item['updated_at'],
+            ':sample': sample_event
+        }
+    )
+
+
+def record_error(error, event):
+    """
+    Record a failed event in the ERROR record for the minute it failed in
+    The first occurrence per (minute, error type) is written right away;
+    repeats are counted in memory and added by flush_errors()
+    """
+    minute = datetime.now().strftime('%Y-%m-%dT%H:%M')
+    error_type = type(error).__name__
+    key = (minute, error_type)
+    with errors_lock:
+        # Only the current minute can still see first occurrences
+        written_error_keys.difference_update(
+            [written for written in written_error_keys if written[0] != minute]
+        )
+        first = key not in written_error_keys
+        if first:
+            written_error_keys.add(key)
+        else:
+            entry = pending_errors.setdefault(key, {'count': 0})
+            entry['count'] += 1
+            entry['last_message'] = str(error)
+            entry.setdefault('sample_event', json.dumps(event))
+
+    if first:
+        try:
+            write_error_record(minute, error_type, 1, str(error), json.dumps(event))
+        except Exception as inner_e:
+            logger.error(f"Failed to save error record: {str(inner_e)}")
+            with errors_lock:
+                entry = pending_errors.setdefault(key, {'count': 0, 'sample_event': json.dumps(event)})
+                entry['count'] += 1
+                entry['last_message'] = str(error)
+
+
+def flush_errors(force=False):
+    """
+    Add repeat error counts to their ERROR records, at most once per
+    ERROR_FLUSH_SECONDS. Counts that fail to flush are kept for the next attempt
+    """
+    global last_error_flush
+    with errors_lock:
+        if not pending_errors:
+            return
+        if not force and time.monotonic() - last_error_flush < ERROR_FLUSH_SECONDS:
+            return
+        batch = dict(pending_errors)
+        pending_errors.clear()
+        last_error_flush = time.monotonic()
+
+    for (minute, error_type), entry in batch.items():
+        try:
+            write_error_record(minute, error_type, entry['count'],
+                               entry['last_message'], entry['sample_event'])
+        except Exception as inner_e:
+            logger.error(f"Failed to save error record: {str(inner_e)}")
+            with errors_lock:
+                current = pending_errors.setdefault((minute, error_type), entry)
+                if current is not entry:
+                    current['count'] += entry['count']
 
 def lambda_handler(event, context):
     """
     Process device monitoring data received from IoT Core and store it in DynamoDB
     Supports both individual metric messages and combined device status messages
     """
+    invocation.deadline = None
+    if context is not None:
+        invocation.deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000
     try:
+        flush_errors()
+
         # Log received event
         logger.info(f"Event received: {json.dumps(event)}")
         
@@ -49,7 +284,7 @@ def lambda_handler(event, context):
             'timestamp': timestamp,
             'raw_data': json.dumps(event)
         }
-        table.put_item(Item=raw_event_item)
+        put_item(raw_event_item)
         logger.info("Raw event data saved")
         
         # Check if this is a combined device status message (contains multiple metrics)
@@ -68,8 +303,8 @@ def lambda_handler(event, context):
                     'connectedSSID': event['connectedSSID'],
                     'timestamp': timestamp
                 }
-                table.put_item(Item=wifi_item)
-                logger.info(f"WiFi data stored: {wifi_item}")
+                if put_metric_item(wifi_item, 'WIFI', ('wifiStatus', 'connectedSSID')):
+                    logger.info(f"WiFi data stored: {wifi_item}")
             
             # 2. Store Bluetooth data
             if 'bluetoothStatus' in event:
@@ -80,8 +315,8 @@ def lambda_handler(event, context):
                     'pairedDevicesCount': event.get('pairedDevicesCount', 0),
                     'timestamp': timestamp
                 }
-                table.put_item(Item=bluetooth_item)
-                logger.info(f"Bluetooth data stored: {bluetooth_item}")
+                if put_metric_item(bluetooth_item, 'BLUETOOTH', ('bluetoothStatus', 'pairedDevicesCount')):
+                    logger.info(f"Bluetooth data stored: {bluetooth_item}")
             
             # 3. Store brightness data
             if 'screenBrightness' in event:
@@ -91,8 +326,8 @@ def lambda_handler(event, context):
                     'screenBrightness': event['screenBrightness'],
                     'timestamp': timestamp
                 }
-                table.put_item(Item=brightness_item)
-                logger.info(f"Brightness data stored: {brightness_item}")
+                if put_metric_item(brightness_item, 'BRIGHTNESS', ('screenBrightness',)):
+                    logger.info(f"Brightness data stored: {brightness_item}")
             
             return {
                 'statusCode': 200,
@@ -109,16 +344,19 @@ def lambda_handler(event, context):
                     'screenBrightness': event['screenBrightness'],
                     'timestamp': timestamp
                 }
-                table.put_item(Item=brightness_item)
-                logger.info(f"Individual brightness data stored: {brightness_item}")
+                if put_metric_item(brightness_item, 'BRIGHTNESS', ('screenBrightness',)):
+                    logger.info(f"Individual brightness data stored: {brightness_item}")
                 
                 # Process brightness control request
                 if event.get('isControlRequest', False):
-                    logger.info(f"Sending brightness control command: {event['screenBrightness']}%")
-                    iot_client.publish(
-                        topic='AMS/brightness/control',
-                        qos=1,
-                        payload=json.dumps({'screenBrightness': event['screenBrightness']})
+                    logger.info(f"Forwarding brightness control command: {event['screenBrightness']}%")
+                    lambda_client.invoke(
+                        FunctionName=BRIGHTNESS_CONTROL_FUNCTION,
+                        InvocationType='Event',
+                        Payload=json.dumps({
+                            'deviceId': device_id,
+                            'screenBrightness': event['screenBrightness']
+                        })
                     )
             
             # Process WiFi data
@@ -130,8 +368,8 @@ def lambda_handler(event, context):
                     'connectedSSID': event.get('connectedSSID', 'Unknown'),
                     'timestamp': timestamp
                 }
-                table.put_item(Item=wifi_item)
-                logger.info(f"Individual WiFi data stored: {wifi_item}")
+                if put_metric_item(wifi_item, 'WIFI', ('wifiStatus', 'connectedSSID')):
+                    logger.info(f"Individual WiFi data stored: {wifi_item}")
             
             # Process Bluetooth data
             elif 'bluetoothStatus' in event:
@@ -142,8 +380,8 @@ def lambda_handler(event, context):
                     'pairedDevicesCount': event.get('pairedDevicesCount', 0),
                     'timestamp': timestamp
                 }
-                table.put_item(Item=bluetooth_item)
-                logger.info(f"Individual Bluetooth data stored: {bluetooth_item}")
+                if put_metric_item(bluetooth_item, 'BLUETOOTH', ('bluetoothStatus', 'pairedDevicesCount')):
+                    logger.info(f"Individual Bluetooth data stored: {bluetooth_item}")
             
             # Process Bluetooth device connection/disconnection status
             elif 'deviceName' in event and 'status' in event:
@@ -154,8 +392,8 @@ def lambda_handler(event, context):
                     'status': event['status'],
                     'timestamp': timestamp
                 }
-                table.put_item(Item=device_status_item)
-                logger.info(f"Device status stored: {device_status_item}")
+                if put_metric_item(device_status_item, 'DEVICE_STATUS', ('deviceName', 'status')):
+                    logger.info(f"Device status stored: {device_status_item}")
             
             return {
                 'statusCode': 200,
@@ -166,17 +404,9 @@ def lambda_handler(event, context):
         logger.error(f"Error processing event: {str(e)}")
         logger.error(f"Event content: {json.dumps(event)}")
         
-        # Attempt to save error record
-        try:
-            error_record = {
-                'PK': f"ERROR#{str(uuid.uuid4())}",
-                'SK': f"ERROR#{datetime.now().isoformat()}",
-                'error_message': str(e),
-                'event_data': json.dumps(event)
-            }
-            table.put_item(Item=error_record)
-        except Exception as inner_e:
-            logger.error(f"Failed to save error record: {str(inner_e)}")
+        # Aggregate error records so a throttling storm does not add one write per failure
+        record_error(e, event)
+        flush_errors()
         
         return {
             'statusCode': 500,
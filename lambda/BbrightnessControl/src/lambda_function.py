@@ -1,42 +1,129 @@
 import json
 import boto3
+import decimal
+from botocore.exceptions import ClientError
 from datetime import datetime
+import os
+import time
+import uuid
 
 # 初始化 DynamoDB 客户端
 dynamodb = boto3.resource('dynamodb')
-table_name = 'ASM'
+table_name = os.environ.get('DYNAMODB_TABLE', 'AMS')
 table = dynamodb.Table(table_name)
 
 # 初始化 AWS IoT 客户端
 iot_client = boto3.client('iot-data', region_name='us-east-1')  # 确保区域正确
 
+CONTROL_TOPIC = 'AMS/brightness/control'
+CONTROL_SK = 'CONTROL#BRIGHTNESS'
+# 每个设备在一个窗口内最多发布一次亮度命令
+DEBOUNCE_WINDOW_SECONDS = float(os.environ.get('DEBOUNCE_WINDOW_SECONDS', '1'))
+
+
+def parse_brightness(value):
+    """亮度必须是 0-100 之间的数字，否则返回 None"""
+    if isinstance(value, bool):
+        return None
+    try:
+        brightness = decimal.Decimal(str(value))
+    except decimal.InvalidOperation:
+        return None
+    if not brightness.is_finite() or not 0 <= brightness <= 100:
+        return None
+    return brightness
+
+
 def lambda_handler(event, context):
-    # 从事件中提取数据
-    screen_brightness = event.get('screenBrightness', None)
-
-    if screen_brightness is not None:
-        record_id = str(uuid.uuid4())
-        partition_key = f"DEVICE#{record_id}"
-        timestamp = datetime.now().isoformat()
-
-        # 将 Brightness 数据存储到 DynamoDB
-        table.put_item(
-            Item={
-                'PK': partition_key,
-                'SK': f"BRIGHTNESS#{timestamp}",
-                'screenBrightness': screen_brightness,
-                'timestamp': timestamp
+    """
+    统一的亮度控制服务
+    同一设备在窗口内的连续亮度命令只保留最新值：每个请求先登记为待发布值，
+    等到窗口结束后只有仍是最新请求的那一个会发布到 AMS/brightness/control，
+    并把生效的亮度设定值记录在 DEVICE#<id> / CONTROL#BRIGHTNESS 中
+    """
+    brightness_value = parse_brightness(event.get('screenBrightness', None))
+    if brightness_value is None:
+        # 无效值重试也不会成功，直接返回 400
+        return {
+            'statusCode': 400,
+            'body': json.dumps({'error': 'screenBrightness must be a number between 0 and 100'})
+        }
+
+    device_id = event.get('deviceId', 'android-device')
+    command_id = event.get('commandId') or str(uuid.uuid4())
+    key = {'PK': f"DEVICE#{device_id}", 'SK': CONTROL_SK}
+
+    # 登记为最新的待发布亮度，覆盖窗口内之前的请求
+    state = table.update_item(
+        Key=key,
+        UpdateExpression='SET pendingBrightness = :b, pendingCommandId = :c, requestedAt = :now',
+        ExpressionAttributeValues={
+            ':b': brightness_value,
+            ':c': command_id,
+            ':now': datetime.now().isoformat()
+        },
+        ReturnValues='ALL_NEW'
+    )['Attributes']
+
+    while True:
+        # 等待上一次发布的窗口结束
+        published_at = state.get('publishedAt')
+        if published_at:
+            elapsed = (datetime.now() - datetime.fromisoformat(published_at)).total_seconds()
+            if elapsed < DEBOUNCE_WINDOW_SECONDS:
+                time.sleep(DEBOUNCE_WINDOW_SECONDS - elapsed)
+
+        now = datetime.now()
+        cutoff = datetime.fromtimestamp(now.timestamp() - DEBOUNCE_WINDOW_SECONDS).isoformat()
+        try:
+            # 只有仍是最新请求且窗口已过时才把待发布值提升为生效设定值
+            table.update_item(
+                Key=key,
+                UpdateExpression=(
+                    'SET screenBrightness = :b, commandId = :c, publishedAt = :now '
+                    'REMOVE pendingBrightness, pendingCommandId, requestedAt'
+                ),
+                ConditionExpression=(
+                    'pendingCommandId = :c AND '
+                    '(attribute_not_exists(publishedAt) OR publishedAt <= :cutoff)'
+                ),
+                ExpressionAttributeValues={
+                    ':b': brightness_value,
+                    ':c': command_id,
+                    ':now': now.isoformat(),
+                    ':cutoff': cutoff
+                }
+            )
+            break
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+        state = table.get_item(Key=key, ConsistentRead=True).get('Item', {})
+        if state.get('pendingCommandId') != command_id:
+            # 已被更新的请求取代，由那个请求负责发布
+            return {
+                'statusCode': 202,
+                'body': json.dumps({'commandId': command_id, 'coalesced': True})
             }
-        )
 
-        # 发布消息到 AWS/brightness/control 主题
-        iot_client.publish(
-            topic='AWS/brightness/control',
-            qos=1,
-            payload=json.dumps({'screenBrightness': screen_brightness})
-        )
+    # 发布消息到 AMS/brightness/control 主题，亮度统一为数字
+    if brightness_value == brightness_value.to_integral_value():
+        published_brightness = int(brightness_value)
+    else:
+        published_brightness = float(brightness_value)
+    iot_client.publish(
+        topic=CONTROL_TOPIC,
+        qos=1,
+        payload=json.dumps({
+            'deviceId': device_id,
+            'commandId': command_id,
+            'timestamp': now.isoformat(),
+            'type': 'SET_BRIGHTNESS',
+            'screenBrightness': published_brightness
+        })
+    )
 
     return {
         'statusCode': 200,
-        'body': json.dumps('Brightness data processed and published to control topic!')
-    }
\ No newline at end of file
+        'body': json.dumps({'commandId': command_id, 'coalesced': False})
+    }
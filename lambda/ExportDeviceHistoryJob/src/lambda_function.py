@@ -0,0 +1,417 @@
+import json
+import boto3
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+import csv
+import decimal
+import gzip
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+# 帮助序列化Decimal类型
+class DecimalEncoder(json.JSONEncoder):
+    def default(self, o):
+        if isinstance(o, decimal.Decimal):
+            return float(o)
+        return super(DecimalEncoder, self).default(o)
+
+# 低级客户端是线程安全的，可在并行查询之间共享
+dynamodb_client = boto3.client('dynamodb')
+s3_client = boto3.client('s3')
+table_name = os.environ.get('DYNAMODB_TABLE', 'AMS')
+deserializer = TypeDeserializer()
+
+# 每种数据类型导出的字段
+EXPORT_FIELDS = {
+    'BRIGHTNESS': ['screenBrightness'],
+    'WIFI': ['wifiStatus', 'connectedSSID'],
+    'BLUETOOTH': ['bluetoothStatus', 'pairedDevicesCount', 'connectedDevicesCount'],
+    'DEVICE_STATUS': ['deviceName', 'status'],
+}
+DEFAULT_CONCURRENCY = int(os.environ.get('EXPORT_CONCURRENCY', '8'))
+DEFAULT_ROWS_PER_CHUNK = int(os.environ.get('EXPORT_ROWS_PER_CHUNK', '50000'))
+QUERY_PAGE_SIZE = int(os.environ.get('EXPORT_QUERY_PAGE_SIZE', '1000'))
+# Lambda 剩余时间低于该值时停止并保存检查点，重新调用同一 jobId 即可续传
+STOP_MARGIN_MS = int(os.environ.get('EXPORT_STOP_MARGIN_MS', '30000'))
+CHECKPOINT_NAME = '_checkpoint.json'
+# 检查点每提交 N 个分块或每隔 T 秒写一次，作业结束时再写一次
+CHECKPOINT_EVERY_COMMITS = int(os.environ.get('EXPORT_CHECKPOINT_EVERY', '20'))
+CHECKPOINT_INTERVAL_SECONDS = float(os.environ.get('EXPORT_CHECKPOINT_SECONDS', '10'))
+
+
+class LocalSink:
+    """导出到本地目录"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def temp_dir(self):
+        # 临时文件放在目标目录内，保证 os.replace 不跨文件系统
+        path = os.path.join(self.root, '.tmp')
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def commit(self, local_path, key):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(local_path, path)
+
+    def read_json(self, key):
+        path = os.path.join(self.root, key)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def write_json(self, key, data):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(path + '.tmp', path)
+
+
+class S3Sink:
+    """导出到 S3，destination 形如 s3://bucket/prefix"""
+
+    def __init__(self, destination):
+        bucket, _, prefix = destination[len('s3://'):].partition('/')
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+
+    def _key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def temp_dir(self):
+        return None
+
+    def commit(self, local_path, key):
+        s3_client.upload_file(local_path, self.bucket, self._key(key))
+        os.remove(local_path)
+
+    def read_json(self, key):
+        try:
+            response = s3_client.get_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            # 模板授予了 s3:ListBucket，不存在的对象返回 NoSuchKey/404；
+            # 403 是真正的权限问题，不能当作新作业从头覆盖已导出的分块
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+        return json.loads(response['Body'].read())
+
+    def write_json(self, key, data):
+        s3_client.put_object(Bucket=self.bucket, Key=self._key(key), Body=json.dumps(data))
+
+
+class ChunkWriter:
+    """把记录流式写入 gzip 临时文件，满一个分块后提交到存储"""
+
+    def __init__(self, export_format, device_id, data_type, temp_dir=None):
+        self.export_format = export_format
+        self.device_id = device_id
+        self.data_type = data_type
+        self.fields = ['deviceId', 'type', 'timestamp'] + EXPORT_FIELDS[data_type]
+        self.rows = 0
+        fd, self.path = tempfile.mkstemp(suffix='.gz', dir=temp_dir)
+        os.close(fd)
+        self.file = gzip.open(self.path, 'wt', newline='')
+        if export_format == 'csv':
+            self.csv_writer = csv.DictWriter(self.file, fieldnames=self.fields, extrasaction='ignore')
+            self.csv_writer.writeheader()
+
+    def write(self, item):
+        row = dict(item)
+        row['deviceId'] = self.device_id
+        row['type'] = self.data_type
+        if self.export_format == 'csv':
+            self.csv_writer.writerow({field: row.get(field, '') for field in self.fields})
+        else:
+            row.pop('PK', None)
+            row.pop('SK', None)
+            self.file.write(json.dumps(row, cls=DecimalEncoder) + '\n')
+        self.rows += 1
+
+    def close(self):
+        self.file.close()
+        return self.path
+
+    def discard(self):
+        self.file.close()
+        os.remove(self.path)
+
+
+def build_sink(destination):
+    if destination.startswith('s3://'):
+        return S3Sink(destination)
+    return LocalSink(destination)
+
+
+def discover_devices():
+    """扫描表中所有 DEVICE# 分区，仅保留设备ID集合"""
+    device_ids = set()
+    kwargs = {
+        'TableName': table_name,
+        'ProjectionExpression': 'PK',
+        'FilterExpression': 'begins_with(PK, :prefix)',
+        'ExpressionAttributeValues': {':prefix': {'S': 'DEVICE#'}}
+    }
+    while True:
+        response = dynamodb_client.scan(**kwargs)
+        for item in response.get('Items', []):
+            device_ids.add(item['PK']['S'].replace('DEVICE#', '', 1))
+        if 'LastEvaluatedKey' not in response:
+            return sorted(device_ids)
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def out_of_time(context):
+    return context is not None and context.get_remaining_time_in_millis() < STOP_MARGIN_MS
+
+
+def export_task(job, device_id, data_type, progress, checkpoint, stop_event):
+    """
+    按 SK 范围分页查询一个设备的一种数据类型，逐页写入分块
+    分块只在页边界提交，检查点记录已提交分块对应的 LastEvaluatedKey
+    """
+    task_id = f"{device_id}/{data_type}"
+    state = progress['tasks'][task_id]
+    extension = 'csv.gz' if job['format'] == 'csv' else 'ndjson.gz'
+    kwargs = {
+        'TableName': table_name,
+        'KeyConditionExpression': 'PK = :pk AND SK BETWEEN :start AND :end',
+        'ExpressionAttributeValues': {
+            ':pk': {'S': f"DEVICE#{device_id}"},
+            ':start': {'S': f"{data_type}#{job['from']}"},
+            ':end': {'S': f"{data_type}#{job['to']}"}
+        },
+        'Limit': min(job['rowsPerChunk'], QUERY_PAGE_SIZE)
+    }
+    if state.get('lastKey'):
+        kwargs['ExclusiveStartKey'] = state['lastKey']
+
+    writer = None
+    while True:
+        if stop_event.is_set() or out_of_time(job['context']):
+            stop_event.set()
+            if writer:
+                writer.discard()
+            return False
+
+        response = dynamodb_client.query(**kwargs)
+        items = response.get('Items', [])
+        if items and writer is None:
+            writer = ChunkWriter(job['format'], device_id, data_type, job['sink'].temp_dir())
+        for raw_item in items:
+            writer.write({k: deserializer.deserialize(v) for k, v in raw_item.items()})
+
+        last_key = response.get('LastEvaluatedKey')
+        finished = last_key is None
+        if writer and (writer.rows >= job['rowsPerChunk'] or finished):
+            key = f"{job['jobId']}/{device_id}/{data_type}/part-{state['parts']:05d}.{extension}"
+            rows = writer.rows
+            job['sink'].commit(writer.close(), key)
+            writer = None
+            checkpoint.update(task_id, committed=True, parts=state['parts'] + 1,
+                              rows=state['rows'] + rows, lastKey=last_key, done=finished)
+        elif finished:
+            # 空任务只在内存中标记完成，随下一次检查点写入
+            checkpoint.update(task_id, lastKey=None, done=True)
+
+        if finished:
+            return True
+        kwargs['ExclusiveStartKey'] = last_key
+
+
+class Checkpointer:
+    """
+    在内存中维护作业进度，并批量写入检查点
+    快照在状态锁内生成，存储写入在锁外进行，不阻塞其他查询线程
+    """
+
+    def __init__(self, sink, key, progress):
+        self.sink = sink
+        self.key = key
+        self.progress = progress
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.pending_commits = 0
+        self.last_write = time.monotonic()
+
+    def update(self, task_id, committed=False, **updates):
+        with self.lock:
+            self.progress['tasks'][task_id].update(updates)
+            if committed:
+                self.pending_commits += 1
+            due = (self.pending_commits >= CHECKPOINT_EVERY_COMMITS or
+                   (self.pending_commits and
+                    time.monotonic() - self.last_write >= CHECKPOINT_INTERVAL_SECONDS))
+        if due:
+            self.flush(blocking=False)
+
+    def flush(self, blocking=True):
+        # 同一时间只有一个线程写检查点；正在写时其他线程直接跳过，进度留给下一次写入
+        if not self.write_lock.acquire(blocking=blocking):
+            return
+        try:
+            with self.lock:
+                self.progress['updatedAt'] = datetime.now().isoformat()
+                snapshot = json.loads(json.dumps(self.progress))
+                self.pending_commits = 0
+                self.last_write = time.monotonic()
+            self.sink.write_json(self.key, snapshot)
+        finally:
+            self.write_lock.release()
+
+
+def resolve_settings(event, saved):
+    """
+    合并请求与检查点中的作业设置
+    新作业补全默认值；续传时沿用检查点中的设置，请求中与之冲突的字段作为错误返回
+    """
+    requested = {}
+    if event.get('deviceIds'):
+        requested['deviceIds'] = list(event['deviceIds'])
+    if event.get('types'):
+        requested['types'] = [t.upper() for t in event['types']]
+    if event.get('from'):
+        requested['from'] = event['from']
+    if event.get('to'):
+        requested['to'] = event['to']
+    if event.get('format'):
+        requested['format'] = event['format'].lower()
+    if event.get('rowsPerChunk'):
+        # 分块边界必须一致，续传时重写的分块才会覆盖同名文件
+        requested['rowsPerChunk'] = int(event['rowsPerChunk'])
+
+    if saved is not None:
+        conflicts = [name for name, value in requested.items() if saved.get(name) != value]
+        return saved, conflicts
+
+    now = datetime.now()
+    settings = {
+        'types': list(EXPORT_FIELDS),
+        'from': (now - timedelta(days=7)).isoformat(),
+        'to': now.isoformat(),
+        'format': 'csv',
+        'rowsPerChunk': DEFAULT_ROWS_PER_CHUNK
+    }
+    settings.update(requested)
+    return settings, []
+
+
+def run_export(job, progress):
+    """执行导出作业，已完成的任务根据检查点跳过"""
+    sink = job['sink']
+    checkpoint_key = f"{job['jobId']}/{CHECKPOINT_NAME}"
+    for device_id in job['deviceIds']:
+        for data_type in job['types']:
+            progress['tasks'].setdefault(f"{device_id}/{data_type}", {
+                'parts': 0, 'rows': 0, 'lastKey': None, 'done': False
+            })
+    checkpoint = Checkpointer(sink, checkpoint_key, progress)
+    # 首次写入检查点时即保存作业设置，之后的续传从这里读取
+    checkpoint.flush()
+
+    stop_event = threading.Event()
+    pending = [task_id for task_id, state in progress['tasks'].items() if not state['done']]
+    try:
+        with ThreadPoolExecutor(max_workers=job['concurrency']) as executor:
+            futures = []
+            for task_id in pending:
+                device_id, _, data_type = task_id.rpartition('/')
+                futures.append(executor.submit(
+                    export_task, job, device_id, data_type, progress, checkpoint, stop_event
+                ))
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception:
+                    # 出错时让其他任务在页边界停下，已提交的分块保留在检查点中
+                    stop_event.set()
+                    raise
+    finally:
+        checkpoint.flush()
+
+    tasks = progress['tasks'].values()
+    completed = sum(1 for state in tasks if state['done'])
+    return {
+        'jobId': job['jobId'],
+        'status': 'COMPLETED' if completed == len(progress['tasks']) else 'INCOMPLETE',
+        'tasks': len(progress['tasks']),
+        'completedTasks': completed,
+        'rows': sum(state['rows'] for state in tasks),
+        'parts': sum(state['parts'] for state in tasks)
+    }
+
+
+def lambda_handler(event, context):
+    """
+    批量导出设备历史数据
+    event: deviceIds(省略则导出全部设备), types, from, to,
+           format(csv|ndjson), destination(本地目录或 s3://bucket/prefix), jobId,
+           rowsPerChunk, concurrency
+    返回 INCOMPLETE 时用同一 jobId 和 destination 重新调用即可从检查点继续，
+    其余设置从检查点读取，可以省略；若传入则必须与检查点一致
+    """
+    try:
+        if not event.get('destination'):
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': 'destination is required'})
+            }
+
+        job_id = event.get('jobId') or str(uuid.uuid4())
+        sink = build_sink(event['destination'])
+        progress = sink.read_json(f"{job_id}/{CHECKPOINT_NAME}")
+        settings, conflicts = resolve_settings(event, progress['settings'] if progress else None)
+        if conflicts:
+            return {
+                'statusCode': 409,
+                'body': json.dumps({
+                    'error': f"Settings conflict with checkpoint of job {job_id}: {', '.join(conflicts)}"
+                })
+            }
+
+        invalid = [t for t in settings['types'] if t not in EXPORT_FIELDS]
+        if invalid or settings['format'] not in ('csv', 'ndjson'):
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': 'Invalid types or format'})
+            }
+
+        if progress is None:
+            if 'deviceIds' not in settings:
+                settings['deviceIds'] = discover_devices()
+            progress = {'jobId': job_id, 'settings': settings, 'tasks': {}}
+
+        job = dict(settings)
+        job.update({
+            'jobId': job_id,
+            'sink': sink,
+            'concurrency': int(event.get('concurrency', DEFAULT_CONCURRENCY)),
+            'context': context
+        })
+
+        result = run_export(job, progress)
+        return {
+            'statusCode': 200,
+            'body': json.dumps(result)
+        }
+
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': str(e)})
+        }
+
+
+if __name__ == '__main__':
+    # 本地运行: python lambda_function.py '{"destination": "./export", "format": "ndjson"}'
+    print(json.dumps(lambda_handler(json.loads(sys.argv[1]), None), indent=2))
@@ -0,0 +1,353 @@
+"""
+Local load generator for the AMS Lambda stack
+
+Emulates K Android agents publishing combined and individual metric messages
+into the real AndroidMontiors handler, while concurrent readers drive the
+device list, details, history and command handlers. DynamoDB is served by
+either moto (in-process) or DynamoDB Local, and IoT publishes go to an
+in-memory stand-in, so no AWS account is needed.
+
+The handlers are imported from lambda/*/src unchanged; only their module-level
+`iot_client` and `lambda_client` are swapped for local stand-ins. Async
+invocations of BbrightnessControl run on a local worker pool and are reported
+as the `brightness_control` operation.
+
+Usage:
+    python lambda/LoadGenerator/load_generator.py --backend moto --agents 20 --rate 2
+    python lambda/LoadGenerator/load_generator.py --backend local --endpoint-url http://localhost:8000
+"""
+import argparse
+import contextlib
+import importlib.util
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+LAMBDA_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+INGEST_FUNCTION = 'AndroidMontiors'
+CONTROL_FUNCTION = 'BbrightnessControl'
+READ_FUNCTIONS = {
+    'devices': 'GetDevicesFunction',
+    'details': 'GetDeviceDetailsFunction',
+    'history': 'GetDeviceHistoryFunction',
+    'command': 'SendDeviceCommandFunction',
+}
+HISTORY_TYPES = ['BRIGHTNESS', 'WIFI', 'BLUETOOTH']
+# The device list, details and history handlers hardcode this table
+READ_TABLE = 'AMS'
+
+
+class LocalIoTData:
+    """In-memory stand-in for the boto3 iot-data client"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.published = defaultdict(int)
+
+    def publish(self, topic, qos=0, payload=None, **kwargs):
+        with self._lock:
+            self.published[topic] += 1
+        return {}
+
+
+class LocalLambda:
+    """In-memory stand-in for the boto3 lambda client, dispatching to loaded handlers"""
+
+    def __init__(self, stats, handlers, max_workers=32):
+        self.stats = stats
+        self.handlers = handlers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def invoke(self, FunctionName, Payload=b'{}', InvocationType='RequestResponse', **kwargs):
+        module = self.handlers[FunctionName]
+        operation = 'brightness_control' if FunctionName == CONTROL_FUNCTION else FunctionName
+        future = self.executor.submit(self.stats.timed, operation, module.lambda_handler,
+                                      json.loads(Payload), None)
+        if InvocationType != 'Event':
+            future.result()
+        return {'StatusCode': 202 if InvocationType == 'Event' else 200}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+class LoadStats:
+    """Thread-safe collector for latencies, errors and DynamoDB calls per operation"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.dynamodb_calls = defaultdict(lambda: defaultdict(int))
+
+    def current_operation(self):
+        return getattr(self._local, 'operation', 'setup')
+
+    def record_dynamodb_call(self, model, **kwargs):
+        with self._lock:
+            self.dynamodb_calls[self.current_operation()][model.name] += 1
+
+    def timed(self, operation, func, *args):
+        self._local.operation = operation
+        start = time.perf_counter()
+        try:
+            response = func(*args)
+            failed = not (200 <= response.get('statusCode', 500) < 300)
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"{operation} raised: {e}")
+            failed = True
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.latencies[operation].append(elapsed_ms)
+            if failed:
+                self.errors[operation] += 1
+        self._local.operation = 'setup'
+
+    def report(self, wall_seconds, iot):
+        operations = {}
+        total = 0
+        for operation, samples in sorted(self.latencies.items()):
+            samples = sorted(samples)
+            count = len(samples)
+            total += count
+            calls = dict(self.dynamodb_calls.get(operation, {}))
+            operations[operation] = {
+                'count': count,
+                'errors': self.errors.get(operation, 0),
+                'throughput_per_s': round(count / wall_seconds, 2),
+                'latency_ms': {
+                    'p50': _percentile(samples, 50),
+                    'p90': _percentile(samples, 90),
+                    'p99': _percentile(samples, 99),
+                    'max': round(samples[-1], 2),
+                },
+                'dynamodb_calls': calls,
+                'dynamodb_calls_per_op': round(sum(calls.values()) / count, 2),
+            }
+        return {
+            'wall_seconds': round(wall_seconds, 2),
+            'total_operations': total,
+            'throughput_per_s': round(total / wall_seconds, 2),
+            'operations': operations,
+            'iot_publishes': dict(iot.published),
+        }
+
+
+def _percentile(sorted_samples, pct):
+    # Nearest-rank percentile
+    index = max(0, int(round(pct / 100 * len(sorted_samples))) - 1)
+    return round(sorted_samples[index], 2)
+
+
+def _load_handler(function_name):
+    path = os.path.join(LAMBDA_ROOT, function_name, 'src', 'lambda_function.py')
+    spec = importlib.util.spec_from_file_location(f"ams_{function_name}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _instrument(module, stats, iot, local_lambda):
+    if hasattr(module, 'iot_client'):
+        module.iot_client = iot
+    if hasattr(module, 'lambda_client'):
+        module.lambda_client = local_lambda
+    if hasattr(module, 'dynamodb'):
+        module.dynamodb.meta.client.meta.events.register(
+            'before-call.dynamodb', stats.record_dynamodb_call
+        )
+
+
+def _ensure_table(table_name):
+    import boto3
+
+    client = boto3.client('dynamodb')
+    if table_name in client.list_tables().get('TableNames', []):
+        return
+    client.create_table(
+        TableName=table_name,
+        KeySchema=[
+            {'AttributeName': 'PK', 'KeyType': 'HASH'},
+            {'AttributeName': 'SK', 'KeyType': 'RANGE'},
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'PK', 'AttributeType': 'S'},
+            {'AttributeName': 'SK', 'AttributeType': 'S'},
+        ],
+        BillingMode='PAY_PER_REQUEST',
+    )
+    client.get_waiter('table_exists').wait(TableName=table_name)
+
+
+def build_agent_message(device_id, combined):
+    """Build a message in the shape published by the Android agent"""
+    message = {'deviceId': device_id, 'timestamp': int(time.time() * 1000)}
+    if combined:
+        message.update({
+            'wifiStatus': random.choice(['ON', 'OFF']),
+            'connectedSSID': f"ssid-{random.randint(1, 5)}",
+            'bluetoothStatus': random.choice(['ON', 'OFF']),
+            'pairedDevicesCount': random.randint(0, 4),
+            'screenBrightness': random.randint(0, 100),
+        })
+        return message
+
+    kind = random.choice(['brightness', 'wifi', 'bluetooth', 'device_status'])
+    if kind == 'brightness':
+        message['screenBrightness'] = random.randint(0, 100)
+    elif kind == 'wifi':
+        message['wifiStatus'] = random.choice(['ON', 'OFF'])
+        message['connectedSSID'] = f"ssid-{random.randint(1, 5)}"
+    elif kind == 'bluetooth':
+        message['bluetoothStatus'] = random.choice(['ON', 'OFF'])
+        message['pairedDevicesCount'] = random.randint(0, 4)
+    else:
+        message['deviceName'] = f"headset-{random.randint(1, 3)}"
+        message['status'] = random.choice(['CONNECTED', 'DISCONNECTED'])
+    return message
+
+
+def build_read_event(operation, device_id):
+    """Build an API Gateway proxy event for one read/command endpoint"""
+    if operation == 'devices':
+        return {}
+    event = {'pathParameters': {'deviceId': device_id}}
+    if operation == 'history':
+        event['queryStringParameters'] = {'type': random.choice(HISTORY_TYPES)}
+    elif operation == 'command':
+        event['body'] = json.dumps({
+            'commandType': 'SET_BRIGHTNESS',
+            'parameters': {'brightness': random.randint(0, 100)},
+        })
+    return event
+
+
+def _paced(rate, deadline, step):
+    # Fixed-rate loop that skips ahead instead of bursting when it falls behind
+    interval = 1.0 / rate
+    next_at = time.monotonic()
+    while True:
+        now = time.monotonic()
+        if now >= deadline:
+            return
+        if next_at > now:
+            time.sleep(min(next_at - now, deadline - now))
+            continue
+        step()
+        next_at = max(next_at + interval, time.monotonic() - interval)
+
+
+def run(args):
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'local')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'local')
+    os.environ['DYNAMODB_TABLE'] = args.table
+
+    mock = None
+    if args.backend == 'moto':
+        try:
+            from moto import mock_aws
+        except ImportError:
+            sys.exit("moto is required for --backend moto (pip install moto)")
+        mock = mock_aws()
+        mock.start()
+    else:
+        os.environ['AWS_ENDPOINT_URL_DYNAMODB'] = args.endpoint_url
+
+    try:
+        _ensure_table(args.table)
+        _ensure_table(READ_TABLE)
+
+        stats = LoadStats()
+        iot = LocalIoTData()
+        invoked = {}
+        local_lambda = LocalLambda(stats, invoked)
+        invoked[CONTROL_FUNCTION] = _load_handler(CONTROL_FUNCTION)
+        _instrument(invoked[CONTROL_FUNCTION], stats, iot, local_lambda)
+        ingest = _load_handler(INGEST_FUNCTION)
+        _instrument(ingest, stats, iot, local_lambda)
+        readers = {}
+        for operation, function_name in READ_FUNCTIONS.items():
+            readers[operation] = _load_handler(function_name)
+            _instrument(readers[operation], stats, iot, local_lambda)
+
+        device_ids = [f"load-device-{i:04d}" for i in range(args.agents)]
+        read_mix = [op for op in READ_FUNCTIONS if op not in args.skip_ops]
+
+        def agent(device_id):
+            def step():
+                combined = random.random() < args.combined_ratio
+                operation = 'ingest_combined' if combined else 'ingest_individual'
+                stats.timed(operation, ingest.lambda_handler,
+                            build_agent_message(device_id, combined), None)
+            return step
+
+        def reader():
+            def step():
+                operation = random.choice(read_mix)
+                stats.timed(operation, readers[operation].lambda_handler,
+                            build_read_event(operation, random.choice(device_ids)), None)
+            return step
+
+        start = time.perf_counter()
+        deadline = time.monotonic() + args.duration
+        threads = [threading.Thread(target=_paced, args=(args.rate, deadline, agent(d)))
+                   for d in device_ids]
+        if read_mix:
+            threads += [threading.Thread(target=_paced, args=(args.reader_rate, deadline, reader()))
+                        for _ in range(args.readers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        local_lambda.shutdown()
+
+        return stats.report(time.perf_counter() - start, iot)
+    finally:
+        if mock is not None:
+            mock.stop()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--backend', choices=['moto', 'local'], default='moto',
+                        help="moto (in-process) or DynamoDB Local at --endpoint-url")
+    parser.add_argument('--endpoint-url', default='http://localhost:8000')
+    parser.add_argument('--table', default=READ_TABLE,
+                        help="DYNAMODB_TABLE for AndroidMontiors and BbrightnessControl; the read "
+                             "handlers always use AMS, so with another table they read no agent data "
+                             "and details requests return 404")
+    parser.add_argument('--agents', type=int, default=10, help="number of emulated Android agents")
+    parser.add_argument('--rate', type=float, default=1.0, help="messages per second per agent")
+    parser.add_argument('--combined-ratio', type=float, default=0.5,
+                        help="fraction of agent messages that are combined status messages")
+    parser.add_argument('--readers', type=int, default=2, help="number of concurrent API readers")
+    parser.add_argument('--reader-rate', type=float, default=2.0, help="requests per second per reader")
+    parser.add_argument('--skip-ops', nargs='*', default=[], choices=list(READ_FUNCTIONS),
+                        help="read operations to leave out of the reader mix")
+    parser.add_argument('--duration', type=float, default=30.0, help="run time in seconds")
+    parser.add_argument('--seed', type=int, default=None)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.seed is not None:
+        random.seed(args.seed)
+    logging.getLogger().setLevel(logging.WARNING)
+    # Some handlers print() every record; keep stdout for the report
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        report = run(args)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,29 @@
 import json
 import boto3
+import decimal
 import uuid
+import os
 from datetime import datetime
 
 # 初始化AWS IoT客户端
 iot_client = boto3.client('iot-data')
 
+# 亮度命令统一交给亮度控制服务去抖后发布
+lambda_client = boto3.client('lambda')
+BRIGHTNESS_CONTROL_FUNCTION = os.environ.get('BRIGHTNESS_CONTROL_FUNCTION', 'BbrightnessControl')
+
+def parse_brightness(value):
+    """亮度必须是 0-100 之间的数字，否则返回 None"""
+    if isinstance(value, bool):
+        return None
+    try:
+        brightness = decimal.Decimal(str(value))
+    except decimal.InvalidOperation:
+        return None
+    if not brightness.is_finite() or not 0 <= brightness <= 100:
+        return None
+    return brightness
+
 def lambda_handler(event, context):
     try:
         # 获取设备ID和命令数据
@@ -27,6 +45,18 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': 'Invalid command type'})
             }
         
+        # 验证亮度参数：异步调用无法把错误返回给调用方，必须在这里拒绝
+        brightness = parameters.get('brightness', 50)
+        if command_type == 'SET_BRIGHTNESS' and parse_brightness(brightness) is None:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Access-Control-Allow-Origin': '*',
+                    'Content-Type': 'application/json'
+                },
+                'body': json.dumps({'error': 'brightness must be a number between 0 and 100'})
+            }
+        
         # 构建命令消息
         command_message = {
             'deviceId': device_id,
@@ -37,21 +67,30 @@ def lambda_handler(event, context):
         
         # 添加特定命令的参数
         if command_type == 'SET_BRIGHTNESS':
-            command_message['screenBrightness'] = parameters.get('brightness', 50)
-            topic = 'AMS/brightness/control'
-        elif command_type == 'TOGGLE_WIFI':
-            command_message['wifiStatus'] = parameters.get('status', 'ON')
-            topic = 'AMS/wifi/control'
-        elif command_type == 'TOGGLE_BLUETOOTH':
-            command_message['bluetoothStatus'] = parameters.get('status', 'ON')
-            topic = 'AMS/bluetooth/control'
-        
-        # 发布命令到IoT主题
-        iot_client.publish(
-            topic=topic,
-            qos=1,
-            payload=json.dumps(command_message)
-        )
+            # 异步调用亮度控制服务，由它合并滑块产生的连续命令
+            lambda_client.invoke(
+                FunctionName=BRIGHTNESS_CONTROL_FUNCTION,
+                InvocationType='Event',
+                Payload=json.dumps({
+                    'deviceId': device_id,
+                    'commandId': command_message['commandId'],
+                    'screenBrightness': brightness
+                })
+            )
+        else:
+            if command_type == 'TOGGLE_WIFI':
+                command_message['wifiStatus'] = parameters.get('status', 'ON')
+                topic = 'AMS/wifi/control'
+            elif command_type == 'TOGGLE_BLUETOOTH':
+                command_message['bluetoothStatus'] = parameters.get('status', 'ON')
+                topic = 'AMS/bluetooth/control'
+            
+            # 发布命令到IoT主题
+            iot_client.publish(
+                topic=topic,
+                qos=1,
+                payload=json.dumps(command_message)
+            )
         
         return {
             'statusCode': 200,